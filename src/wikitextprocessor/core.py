@@ -13,6 +13,7 @@ import urllib.parse
 from collections import defaultdict, deque
 from collections.abc import Callable, Sequence, Set
 from dataclasses import dataclass
+from datetime import datetime
 from functools import lru_cache
 from importlib.resources import files
 from pathlib import Path
@@ -254,6 +255,7 @@ class Wtp:
         "rev_ht",  # Mapping from text to magic cookie
         "expand_stack",  # Saved stack before calling Lua function
         "title",  # current page title
+        "page_time",  # time for CURRENT* magic words (cleared for each page)
         "warnings",  # List of warning messages (cleared for each new page)
         # Data for parsing
         "beginning_of_line",  # Parser at beginning of line
@@ -271,6 +273,7 @@ class Wtp:
         "NAMESPACE_DATA",
         "LOCAL_NS_NAME_BY_ID",  # Local namespace names dictionary
         "NS_ID_BY_LOCAL_NAME",
+        "LOCAL_NS_NAME_BY_LOWER_ALIAS",
         "lang_code",
         # Python functions for overriding template expanded text
         "template_override_funcs",
@@ -328,6 +331,7 @@ class Wtp:
         self.begline_disabled = BegLineDisableManager(self)
         self.wsp_beginning_of_line = False
         self.title: Optional[str] = None
+        self.page_time: Optional[datetime] = None
         self.section = None
         self.subsection = None
         self.linenum = 1
@@ -478,6 +482,14 @@ class Wtp:
                 data["name"]: data["id"]
                 for data in self.NAMESPACE_DATA.values()
             }
+            # Lowercased canonical names, local names and aliases; the
+            # first namespace that has a name wins
+            self.LOCAL_NS_NAME_BY_LOWER_ALIAS: dict[str, str] = {}
+            for key, data in self.NAMESPACE_DATA.items():
+                for alias in [key, data["name"]] + data["aliases"]:
+                    self.LOCAL_NS_NAME_BY_LOWER_ALIAS.setdefault(
+                        alias.lower(), data["name"]
+                    )
 
     def _fmt_errmsg(self, kind: str, msg: str, trace: Optional[str]) -> None:
         assert isinstance(kind, str)
@@ -589,13 +601,20 @@ class Wtp:
             "debugs": self.debugs,
         }
 
+    @lru_cache(maxsize=4096)
     def _canonicalize_parserfn_name(self, name: str) -> str:
         """Canonicalizes a parser function name by replacing underscores by
-        spaces and sequences of whitespace by a single whitespace."""
+        spaces and sequences of whitespace by a single whitespace.  This is
+        called for every template and parser function name during
+        expansion, so the results are cached (PARSER_FUNCTIONS does not
+        change after import, like PARSER_FUNCTION_TABLE built from it in
+        parserfns.py).  The returned names are
+        interned so that looking them up in the parser function tables
+        can compare the keys by identity."""
         name = re.sub(r"[\s_]+", " ", name)
         if name not in PARSER_FUNCTIONS:
             name = name.lower()  # Parser function names are case-insensitive
-        return name
+        return sys.intern(name)
 
     def _save_value(
         self, kind: str, args: Sequence[str], nowiki: bool
@@ -920,6 +939,9 @@ class Wtp:
         ):
             body = self._template_to_body(title, body)
 
+        # get_page() caches its results, including None for pages that did
+        # not exist yet
+        self.get_page.cache_clear()
         self.db_conn.execute(
             """INSERT INTO pages (title, namespace_id, body,
         redirect_to, need_pre_expand, model) VALUES (?, ?, ?, ?, ?, ?)
@@ -1020,6 +1042,7 @@ class Wtp:
         self.warnings, and self.debugs lists and any current section
         or subsection."""
         self.title = title
+        self.page_time = None
         self.errors = []
         self.warnings = []
         self.debugs = []
@@ -1272,6 +1295,10 @@ class Wtp:
                 self.expand_stack.append(fn_name)
 
                 def expander(arg: str) -> str:
+                    # Arguments without magic characters (templates,
+                    # template arguments or links) expand to themselves
+                    if MAGIC_RE_PATTERN.search(arg) is None:
+                        return arg
                     return expand_recurse(arg, parent, True)
 
                 if fn_name in self.parser_function_aliases:
@@ -1903,10 +1930,13 @@ class Wtp:
             node_handler_fn=node_handler_fn,
         )
 
+    @lru_cache(maxsize=256)
     def namespace_prefixes(
         self, ns_id: int, lower: bool = True, suffix: str = ":"
     ) -> tuple[str, ...]:
-        """Based on given namespace name, create a tuple of aliases"""
+        """Based on given namespace name, create a tuple of aliases.  This
+        is called for every template node and page lookup, and the
+        namespace data does not change, so the results are cached."""
         for ns, ns_data in self.NAMESPACE_DATA.items():
             if ns_data["id"] == ns_id:
                 prefixes = tuple(
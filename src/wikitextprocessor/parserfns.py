@@ -2,18 +2,27 @@
 #
 # Copyright (c) 2020-2022 Tatu Ylonen.  See file LICENSE and https://ylonen.org
 
+import calendar
 import html
 import math
+import operator
 import re
+import sys
 import urllib.parse
 from collections.abc import Callable, Sequence
 from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
 from typing import TYPE_CHECKING, Optional, Union
 
 import dateparser
 
-from .common import MAGIC_NOWIKI_CHAR, add_newline_to_expansion, nowiki_quote
+from .common import (
+    MAGIC_NOWIKI_CHAR,
+    MAGIC_RE_PATTERN,
+    add_newline_to_expansion,
+    nowiki_quote,
+)
 from .interwiki import get_interwiki_map
 
 if TYPE_CHECKING:
@@ -23,9 +32,48 @@ if TYPE_CHECKING:
 # https://www.mediawiki.org/wiki/Help:Extension:ParserFunctions
 # https://www.mediawiki.org/wiki/Help:Magic_words
 
+# Regular expression for attributes given to #tag
+TAG_ATTR_RE = re.compile(r"""(?s)^([^=<>'"]+)=(.*)$""")
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+# Error messages generated by parser functions, checked by #iferror
+ERROR_CLASS_RE = re.compile(r'<[^>]*?\sclass="error"')
+
+# Separators of the title parts for #titleparts
+TITLEPARTS_RE = re.compile(r"([:/])")
+
+# Begin and end tags of the labeled sections transcluded by #lst
+LST_SECTION_TAG_RE = re.compile(
+    r'(?si)<section\s+(begin|end)="?([^"<>]*?)"?\s*/>'
+)
+
+
+@lru_cache(maxsize=64)
+def lst_sections(text: str) -> dict[str, list[str]]:
+    """Splits a page into its labeled sections for #lst, in a single pass
+    over the section tags.  Returns a dictionary from lowercased section
+    name to the contents of each begin/end pair with that name, in page
+    order.  Pages are often transcluded section by section, so the index
+    is cached."""
+    sections: dict[str, list[str]] = {}
+    starts: dict[str, int] = {}
+    for m in LST_SECTION_TAG_RE.finditer(text):
+        kind, name = m.groups()
+        name = name.lower()
+        if kind.lower() == "begin":
+            starts.setdefault(name, m.end())
+        elif name in starts:
+            sections.setdefault(name, []).append(
+                text[starts.pop(name) : m.start()]
+            )
+    return sections
+
 
 def capitalizeFirstOnly(s: str) -> str:
-    if s:
+    # Most titles already start with an uppercase letter, which str.upper()
+    # would return unchanged
+    if s and not s[0].isupper():
         s = s[0].upper() + s[1:]
     return s
 
@@ -52,7 +100,9 @@ def ifeq_fn(
     arg1: str = args[1] if len(args) >= 2 else ""
     arg2: str = args[2] if len(args) >= 3 else ""
     arg3: str = args[3] if len(args) >= 4 else ""
-    if expander(arg0).strip() == expander(arg1).strip():
+    # Identical unexpanded arguments expand identically, so skip expanding
+    # them (common with e.g. both sides empty)
+    if arg0 == arg1 or expander(arg0).strip() == expander(arg1).strip():
         return expander(arg2).strip()
     return expander(arg3).strip()
 
@@ -64,7 +114,7 @@ def iferror_fn(
     arg0: str = expander(args[0]) if args else ""
     arg1: Optional[str] = args[1] if len(args) >= 2 else None
     arg2: Optional[str] = args[2] if len(args) >= 3 else None
-    if re.search(r'<[^>]*?\sclass="error"', arg0):
+    if 'class="error"' in arg0 and ERROR_CLASS_RE.search(arg0):
         if arg1 is None:
             return ""
         return expander(arg1).strip()
@@ -102,32 +152,79 @@ def ifexist_fn(
     return expander(arg2).strip()
 
 
+@lru_cache(maxsize=1024)
+def _switch_table(
+    cases: tuple[str, ...],
+) -> Optional[tuple[dict[str, str], Optional[str], str]]:
+    """Builds a lookup table for the cases of a #switch when none of the
+    case keys need expansion.  Returns (table, default, last), where
+    ``table`` maps each key to its unexpanded value, ``default`` is the
+    value of the last #default case and ``last`` is a trailing bare
+    value, or None if some key contains templates or other magic
+    characters.  A bare key (without "=") falls through to the value of
+    the next keyed case, so it is mapped to that value.  If a key occurs
+    several times, the first occurrence wins, as with a linear scan.
+    The same #switch is evaluated over and over again with different
+    values, so the tables are cached (they must not be modified)."""
+    table: dict[str, str] = {}
+    defval: Optional[str] = None
+    pending: list[str] = []
+    last = ""
+    for arg in cases:
+        k, sep, v = arg.partition("=")
+        if MAGIC_RE_PATTERN.search(k):
+            return None
+        k = k.strip()
+        if not sep:
+            pending.append(k)
+            last = k
+            continue
+        for key in pending:
+            table.setdefault(key, v)
+        pending = []
+        table.setdefault(k, v)
+        if k.lower() == "#default":
+            defval = v
+        last = ""
+    return table, defval, last
+
+
 def switch_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements #switch parser function."""
     val = expander(args[0]).strip() if args else ""
+    cases = args[1:]
+    switch_table = _switch_table(tuple(cases))
+    if switch_table is not None:
+        # Fast path: all keys are literal text, so we don't need to
+        # expand them and can look the value up directly.
+        table, defval, last = switch_table
+        v = table.get(val)
+        if v is not None:
+            return expander(v).strip()
+        if defval is not None:
+            return expander(defval).strip()
+        return last
     match_next = False
-    defval: Optional[str] = None
-    last: Optional[str] = None
-    for i in range(1, len(args)):
-        arg = args[i]
-        m = re.match(r"(?s)^([^=]*)=(.*)$", arg)
-        if not m:
-            last = expander(arg).strip()
-            if last == val:
+    defval = None
+    last_expanded: Optional[str] = None
+    for arg in cases:
+        k, sep, v = arg.partition("=")
+        if not sep:
+            last_expanded = expander(arg).strip()
+            if last_expanded == val:
                 match_next = True
             continue
-        k, v = m.groups()
         k = expander(k).strip()
         if k == val or match_next:
             return expander(v).strip()
         if k.lower() == "#default":
             defval = v
-        last = None
+        last_expanded = None
     if defval is not None:
         return expander(defval).strip()
-    return last or ""
+    return last_expanded or ""
 
 
 def categorytree_fn(
@@ -160,14 +257,7 @@ def lst_fn(
         )
         return ""
 
-    parts: list[str] = []
-    for m in re.finditer(
-        r'(?si)<section\s+begin="?{}"?\s*/>(.*?)<section\s+end="?{}"?\s*/>'.format(
-            re.escape(chapter), re.escape(chapter)
-        ),
-        text,
-    ):
-        parts.append(m.group(1))
+    parts = lst_sections(text).get(chapter.lower(), [])
     if not parts:
         ctx.warning(
             "{} could not find chapter {!r} on page {!r}".format(
@@ -194,7 +284,7 @@ def tag_fn(
     if len(args) > 2:
         for x in args[2:]:
             x = expander(x)
-            m = re.match(r"""(?s)^([^=<>'"]+)=(.*)$""", x)
+            m = TAG_ATTR_RE.match(x)
             if not m:
                 ctx.warning(
                     "invalid attribute format {!r} missing name".format(x),
@@ -204,15 +294,12 @@ def tag_fn(
             name, value = m.groups()
             if not value.startswith('"') and not value.startswith("'"):
                 value = '"' + html.escape(value, quote=True) + '"'
-            attrs.append("{}={}".format(name, value))
-    if attrs:
-        attrs_str = " " + " ".join(attrs)
-    else:
-        attrs_str = ""
+            attrs.append(f"{name}={value}")
+    attrs_str = " " + " ".join(attrs) if attrs else ""
     if not content:
-        ret = "<{}{} />".format(tag, attrs_str)
+        ret = f"<{tag}{attrs_str} />"
     else:
-        ret = "<{}{}>{}</{}>".format(tag, attrs_str, content, tag)
+        ret = f"<{tag}{attrs_str}>{content}</{tag}>"
     if tag == "nowiki":
         if len(args) == 0:
             ret = MAGIC_NOWIKI_CHAR
@@ -221,19 +308,40 @@ def tag_fn(
     return ret
 
 
+def title_arg(
+    ctx: "Wtp",
+    args: list[str],
+    expander: Callable[[str], str],
+    default: str = "PAGENAME_ERROR",
+) -> str:
+    """Returns the title given as the first argument of a page name magic
+    word, or the title of the current page, with whitespace normalized."""
+    t = expander(args[0]) if args else ctx.title or default
+    return WHITESPACE_RE.sub(" ", t).strip()
+
+
+def title_without_namespace(t: str) -> str:
+    """Returns a (normalized) title without its namespace prefix."""
+    ofs = t.find(":")
+    if ofs >= 0:
+        # t = capitalizeFirstOnly(t[ofs + 1:])
+        t = t[ofs + 1 :]
+    # else:
+    #    t = capitalizeFirstOnly(t)
+    return t
+
+
 def fullpagename_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the FULLPAGENAME magic word/parser function."""
-    t = expander(args[0]) if args else ctx.title or "PAGENAME_ERROR"
-    t = re.sub(r"\s+", " ", t)
-    t = t.strip()
+    t = title_arg(ctx, args, expander)
     ofs = t.find(":")
     if ofs == 0:
         # t = capitalizeFirstOnly(t[1:])
         t = t[1:]
     elif ofs > 0:
-        ns = capitalizeFirstOnly(t[:ofs])
+        ns = t[:1].upper() + t[1:ofs]  # capitalizeFirstOnly(t[:ofs])
         # t = capitalizeFirstOnly(t[ofs + 1:])
         t = t[ofs + 1 :]
         t = ns + ":" + t
@@ -270,77 +378,53 @@ def pagename_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the PAGENAME magic word/parser function."""
-    t = expander(args[0]) if args else ctx.title or "PAGENAME_ERROR"
-    t = re.sub(r"\s+", " ", t)
-    t = t.strip()
-    ofs = t.find(":")
-    if ofs >= 0:
-        # t = capitalizeFirstOnly(t[ofs + 1:])
-        t = t[ofs + 1 :]
-    # else:
-    #    t = capitalizeFirstOnly(t)
-    return t
+    return title_without_namespace(title_arg(ctx, args, expander))
 
 
 def basepagename_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the BASEPAGENAME magic word/parser function."""
-    t = expander(args[0]) if args else ctx.title or "PAGENAME_ERROR"
-    t = re.sub(r"\s+", " ", t)
-    t = t.strip()
+    t = title_arg(ctx, args, expander)
     ofs = t.rfind("/")
     if ofs >= 0:
-        t = t[:ofs]
-    return pagename_fn(ctx, fn_name, [t], lambda x: x)
+        t = t[:ofs].strip()
+    return title_without_namespace(t)
 
 
 def rootpagename_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the ROOTPAGENAME magic word/parser function."""
-    t = expander(args[0]) if args else ctx.title or "PAGENAME_ERROR"
-    t = re.sub(r"\s+", " ", t)
-    t = t.strip()
+    t = title_arg(ctx, args, expander)
     ofs = t.find("/")
     if ofs >= 0:
-        t = t[:ofs]
-    return pagename_fn(ctx, fn_name, [t], lambda x: x)
+        t = t[:ofs].strip()
+    return title_without_namespace(t)
 
 
 def subpagename_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the SUBPAGENAME magic word/parser function."""
-    t = expander(args[0]) if args else ctx.title or "PAGENAME_ERROR"
-    t = re.sub(r"\s+", " ", t)
-    t = t.strip()
+    t = title_arg(ctx, args, expander)
     ofs = t.rfind("/")
     if ofs >= 0:
         return t[ofs + 1 :]
     else:
-        return pagename_fn(ctx, fn_name, [t], lambda x: x)
+        return title_without_namespace(t)
 
 
 def talkpagename_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the TALKPAGENAME magic word."""
-    if ctx.title is not None:
-        ofs = ctx.title.find(":")
-    else:
+    if ctx.title is None:
         return "ERROR_PAGENAME"
-    if ofs < 0:
+    prefix, sep, rest = ctx.title.partition(":")
+    if not sep or prefix not in ctx.NAMESPACE_DATA:
         return ctx.NAMESPACE_DATA["Talk"]["name"] + ":" + ctx.title
-    else:
-        prefix = ctx.title[:ofs]
-        if prefix not in ctx.NAMESPACE_DATA:
-            return ctx.NAMESPACE_DATA["Talk"]["name"] + ":" + ctx.title
-        return (
-            ctx.NAMESPACE_DATA[prefix + " talk"]["name"]
-            + ":"
-            + ctx.title[ofs + 1 :]
-        )
+    return ctx.NAMESPACE_DATA[prefix + " talk"]["name"] + ":" + rest
 
 
 def namespacenumber_fn(
@@ -356,12 +440,11 @@ def namespace_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the NAMESPACE magic word/parser function."""
-    t = expander(args[0]) if args else ctx.title or "ERROR_NAMESPACE"
-    t = re.sub(r"\s+", " ", t)
-    t = t.strip()
+    t = title_arg(ctx, args, expander, "ERROR_NAMESPACE")
     ofs = t.find(":")
     if ofs >= 0:
-        ns = capitalizeFirstOnly(t[:ofs])
+        ns = t[:ofs]
+        ns = ns[:1].upper() + ns[1:]  # capitalizeFirstOnly(ns)
         if ns == "Project":
             return ctx.NAMESPACE_DATA["Project"]["name"]
         return ns
@@ -374,9 +457,9 @@ def subjectspace_fn(
     """Implements the SUBJECTSPACE magic word/parser function.  This
     implementation is very minimal."""
     t = expander(args[0]) if args else ctx.title or "ERROR_NAMESPACE"
-    for prefix in ctx.NAMESPACE_DATA:
-        if t.startswith(prefix + ":"):
-            return prefix
+    prefix, sep, _ = t.partition(":")
+    if sep and prefix in ctx.NAMESPACE_DATA:
+        return prefix
     return ""
 
 
@@ -386,9 +469,9 @@ def talkspace_fn(
     """Implements the TALKSPACE magic word/parser function.  This
     implementation is very minimal."""
     t = expander(args[0]) if args else ctx.title or "ERROR_NAMESPACE"
-    for prefix in ctx.NAMESPACE_DATA:
-        if t.startswith(prefix + ":"):
-            return ctx.NAMESPACE_DATA[prefix + " talk"]["name"]
+    prefix, sep, _ = t.partition(":")
+    if sep and prefix in ctx.NAMESPACE_DATA:
+        return ctx.NAMESPACE_DATA[prefix + " talk"]["name"]
     return ctx.NAMESPACE_DATA["Talk"]["name"]
 
 
@@ -406,25 +489,54 @@ def servername_fn(
     return f"{ctx.lang_code}.{ctx.project}.org"
 
 
+# English month names for the *MONTHNAME and *MONTHABBREV magic words,
+# indexed by month number
+MONTH_NAMES = (
+    "",
+    "January",
+    "February",
+    "March",
+    "April",
+    "May",
+    "June",
+    "July",
+    "August",
+    "September",
+    "October",
+    "November",
+    "December",
+)
+MONTH_ABBREVS = tuple(name[:3] for name in MONTH_NAMES)
+
+
+def page_time(ctx: "Wtp") -> datetime:
+    """Returns the current time in UTC for the CURRENT* and LOCAL* magic
+    words.  Like MediaWiki, this uses the same time for the whole page,
+    so it is only read from the clock once per page."""
+    if ctx.page_time is None:
+        ctx.page_time = datetime.now(timezone.utc)
+    return ctx.page_time
+
+
 def currentyear_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the CURRENTYEAR magic word."""
-    return str(datetime.now(timezone.utc).year)
+    return str(page_time(ctx).year)
 
 
 def currentmonth_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the CURRENTMONTH magic word."""
-    return datetime.now(timezone.utc).strftime("%m")
+    return page_time(ctx).strftime("%m")
 
 
 def currentmonth1_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the CURRENTMONTH1 magic word."""
-    return str(datetime.now(timezone.utc).month)
+    return str(page_time(ctx).month)
 
 
 def currentmonthname_fn(
@@ -432,7 +544,7 @@ def currentmonthname_fn(
 ) -> str:
     """Implements the CURRENTMONTHNAME magic word."""
     # XXX support for other languages?
-    return datetime.now(timezone.utc).strftime("%B")
+    return MONTH_NAMES[page_time(ctx).month]
 
 
 def currentmonthabbrev_fn(
@@ -440,73 +552,69 @@ def currentmonthabbrev_fn(
 ) -> str:
     """Implements the CURRENTMONTHABBREV magic word."""
     # XXX support for other languages?
-    return datetime.now(timezone.utc).strftime("%b")
+    return MONTH_ABBREVS[page_time(ctx).month]
 
 
 def currentday_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the CURRENTDAY magic word."""
-    return str(datetime.now(timezone.utc).day)
+    return str(page_time(ctx).day)
 
 
 def currentday2_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the CURRENTDAY2 magic word."""
-    return datetime.now(timezone.utc).strftime("%d")
+    return page_time(ctx).strftime("%d")
 
 
 def currentdow_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
-    return str(datetime.now(timezone.utc).isoweekday() % 7)
+    return str(page_time(ctx).isoweekday() % 7)
 
 
 def currentdayname_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the CURRENTDAYNAME magic word."""
-    return datetime.now(timezone.utc).strftime("%A")
+    return page_time(ctx).strftime("%A")
 
 
 def currenttime_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the CURRENTTIME magic word."""
-    return datetime.now(timezone.utc).strftime("%H:%M")
+    return page_time(ctx).strftime("%H:%M")
 
 
 def currenthour_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the CURRENTHOUR magic word."""
-    return datetime.now(timezone.utc).strftime("%H")
+    return page_time(ctx).strftime("%H")
 
 
 def currentweek_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the CURRENTWEEK magic word."""
-    return datetime.now(timezone.utc).strftime("%W")
+    return page_time(ctx).strftime("%W")
 
 
 def localweek_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the LOCALWEEK magic word."""
-    return datetime.now(timezone.utc).astimezone().strftime("%W")
+    return page_time(ctx).astimezone().strftime("%W")
 
 
 def local_timestamp_fn(
     wtp: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the LOCALTIMESTAMP magic word."""
-    return (
-        datetime.now(timezone.utc)
-        .astimezone()
-        .strftime(MEDIAWIKI_TIMESTAMP_FORMAT)
-    )
+    return page_time(wtp).astimezone().strftime(MEDIAWIKI_TIMESTAMP_FORMAT)
 
 
 def revisionid_fn(
@@ -598,26 +706,74 @@ def formatnum_fn(
     # XXX implement support for non-english locales for digits
     orig = arg0.split(".")
     first = orig[0]
-    parts = []
-    first = "".join(reversed(first))
-    for i in range(0, len(first), 3):
-        parts.append("".join(reversed(first[i : i + 3])))
-    parts = [sep.join(reversed(parts))]
+    sign = ""
+    if first.startswith(("-", "+")):
+        sign = first[0]
+        first = first[1:]
+    if not sep or len(first) <= 3:
+        grouped = first
+    elif first.isascii() and first.isdigit() and first[0] != "0":
+        # int formatting groups the digits in C; it would drop leading zeros
+        grouped = format(int(first), ",d")
+    else:
+        # Group characters from the right: the first group holds the rest
+        head = len(first) % 3
+        groups = [first[:head]] if head else []
+        groups.extend(first[i : i + 3] for i in range(head, len(first), 3))
+        grouped = sep.join(groups)
+    parts = [sign + grouped]
     if len(orig) > 1:
         parts.append(comma)
         parts.append(".".join(orig[1:]))
     return "".join(parts)
 
 
+THREE_DIGITS_RE = re.compile(r"\d\d\d")
+
+ISO_DATE_RE = re.compile(r"(\d{4})-(\d\d)-(\d\d)(?:[T ](\d\d):(\d\d):(\d\d))?")
+
+
+# strftime formats for the named #dateformat formats: date without a year,
+# date, and date with time
+DATEFORMAT_FORMATS = {
+    "mdy": ("%b %d", "%b %d, %Y", "%b %d, %Y %H:%M:%S"),
+    "dmy": ("%d %b", "%d %b %Y", "%d %b %Y %H:%M:%S"),
+    "ymd": ("%b %d", "%Y %b %d", "%Y %b %d %H:%M:%S"),
+}
+
+
+@lru_cache(maxsize=4096)
+def parse_date(text: str) -> Optional[datetime]:
+    """Parses a date given to #dateformat.  Dates in ISO 8601 format are
+    converted directly; anything else goes through dateparser, which is
+    slow.  The same dates recur on many pages, so the results are
+    cached."""
+    m = ISO_DATE_RE.fullmatch(text)
+    if m is not None:
+        try:
+            y, mo, d, h, mi, sec = m.groups()
+            return datetime(
+                int(y),
+                int(mo),
+                int(d),
+                int(h or 0),
+                int(mi or 0),
+                int(sec or 0),
+            )
+        except ValueError:
+            pass
+    return dateparser.parse(text)
+
+
 def dateformat_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the #dateformat (= #formatdate) parser function."""
     arg0 = expander(args[0]) if args else ""
     arg0x = arg0
-    if not re.search(r"\d\d\d", arg0x):
+    if not THREE_DIGITS_RE.search(arg0x):
         arg0x += " 3333"
-    dt = dateparser.parse(arg0x)
+    dt = parse_date(arg0x)
     if not dt:
         # It seems this should return invalid dates as-is
         return arg0
@@ -626,24 +782,13 @@ def dateformat_fn(
     if fmt in ("ISO 8601", "ISO8601") and dt.year == 0:
         fmt = "mdy"
     date_only = dt.hour == 0 and dt.minute == 0 and dt.second == 0
-    if fmt == "mdy":
-        if date_only:
-            if dt.year == 3333:
-                return dt.strftime("%b %d")
-            return dt.strftime("%b %d, %Y")
-        return dt.strftime("%b %d, %Y %H:%M:%S")
-    elif fmt == "dmy":
-        if date_only:
-            if dt.year == 3333:
-                return dt.strftime("%d %b")
-            return dt.strftime("%d %b %Y")
-        return dt.strftime("%d %b %Y %H:%M:%S")
-    elif fmt == "ymd":
-        if date_only:
-            if dt.year == 3333:
-                return dt.strftime("%b %d")
-            return dt.strftime("%Y %b %d")
-        return dt.strftime("%Y %b %d %H:%M:%S")
+    formats = DATEFORMAT_FORMATS.get(fmt)
+    if formats is not None:
+        if not date_only:
+            return dt.strftime(formats[2])
+        if dt.year == 3333:
+            return dt.strftime(formats[0])
+        return dt.strftime(formats[1])
     # Otherwise format into ISO format
     if date_only:
         return dt.date().isoformat()
@@ -675,12 +820,11 @@ def fullurl_fn(
     """
     page_name = expander(args[0]).strip() if args else ""
     url = f"//{ctx.lang_code}.{ctx.project}.org/wiki/$1"
-    if ":" in page_name:
-        quote_index = page_name.index(":")
-        interwiki_prefix = page_name[:quote_index]
+    interwiki_prefix, sep, rest = page_name.partition(":")
+    if sep:
         interwiki_map = get_interwiki_map(ctx)
         if interwiki_prefix in interwiki_map:
-            page_name = page_name[quote_index + 1 :]
+            page_name = rest
             url = interwiki_map[interwiki_prefix]["url"]  # type: ignore
 
     url = url.replace(
@@ -709,27 +853,25 @@ def urlencode_fn(
 
 def wikiurlencode(url: str) -> str:
     assert isinstance(url, str)
-    url = re.sub(r"\s+", "_", url)
+    url = WHITESPACE_RE.sub("_", url)
     return urllib.parse.quote(url, safe="/:")
 
 
+# I am not sure how MediaWiki encodes these but HTML5 at least allows
+# any character except any type of space character.  However, we also
+# replace quotes and "<>", just in case these are used inside attributes.
+# The replacements are their percent-encodings with "%" replaced by ".".
+# XXX should really check from MediaWiki source code
+ANCHOR_TRANS = str.maketrans({"'": ".27", '"': ".22", "<": ".3C", ">": ".3E"})
+
+
 def anchorencode_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the urlencode parser function."""
     anchor = expander(args[0]).strip() if args else ""
-    anchor = re.sub(r"\s+", "_", anchor)
-
-    # I am not sure how MediaWiki encodes these but HTML5 at least allows
-    # any character except any type of space character.  However, we also
-    # replace quotes and "<>", just in case these are used inside attributes.
-    # XXX should really check from MediaWiki source code
-    def repl_anchor(m):
-        v = urllib.parse.quote(m.group(0))
-        return v.replace("%", ".")
-
-    anchor = re.sub(r"""['"<>]""", repl_anchor, anchor)
-    return anchor
+    anchor = WHITESPACE_RE.sub("_", anchor)
+    return anchor.translate(ANCHOR_TRANS)
 
 
 def ns_fn(
@@ -742,14 +884,12 @@ def ns_fn(
     arg = expander(args[0]).strip() if args else ""
     if arg in ["0", ""]:
         return ""
-    lc_arg = arg.lower()
-    for key, ns in wtp.NAMESPACE_DATA.items():
-        if arg.isdigit() and ns["id"] == int(arg):
-            return ns["name"]
-        if ns["name"].lower() == lc_arg or lc_arg == key.lower():
-            return ns["name"]
-        if lc_arg in [alias.lower() for alias in ns["aliases"]]:
-            return ns["name"]
+    if arg.isdecimal():
+        ns_name = wtp.LOCAL_NS_NAME_BY_ID.get(int(arg))
+    else:
+        ns_name = wtp.LOCAL_NS_NAME_BY_LOWER_ALIAS.get(arg.lower())
+    if ns_name is not None:
+        return ns_name
     template_ns_name = wtp.NAMESPACE_DATA["Template"]["name"]
     return f"[[:{template_ns_name}:ns:{arg}]]"
 
@@ -771,7 +911,11 @@ def titleparts_fn(
         first = int(arg2)
     except ValueError:
         pass
-    parts = re.split(r"([:/])", t)
+    # parts alternate with the separators
+    if ":" in t or "/" in t:
+        parts = TITLEPARTS_RE.split(t)
+    else:
+        parts = [t]
     num_parts = (len(parts) + 1) // 2
     if first < 0:
         first = max(0, num_parts + first)
@@ -785,21 +929,33 @@ def titleparts_fn(
     return "".join(parts)
 
 
+class ExprError(Exception):
+    """Raised for syntax errors and failed operations (e.g., division by
+    zero) in #expr.  The message is what #expr returns."""
+
+
 BinaryCallable = Callable[
-    [Union[int, float], Union[int, float]], Union[int, float, str]
+    [Union[int, float], Union[int, float]], Union[int, float]
 ]
-UnaryCallable = Callable[[Union[int, float]], Union[int, float, str]]
+UnaryCallable = Callable[[Union[int, float]], Union[int, float]]
+
+
+def expr_sqrt(x: Union[int, float]) -> float:
+    if x < 0:
+        raise ExprError("sqrt of negative value")
+    return math.sqrt(x)
+
 
 # Supported unary functions for #expr
 unary_fns: dict[str, UnaryCallable] = {
-    "-": lambda x: -x,  # Kludge to have this here besides parse_unary
-    "+": lambda x: x,  # Kludge to have this here besides parse_unary
+    "-": operator.neg,  # Kludge to have this here besides parse_unary
+    "+": operator.pos,  # Kludge to have this here besides parse_unary
     "not": lambda x: int(not x),
     "ceil": math.ceil,
     "trunc": math.trunc,
     "floor": math.floor,
     "abs": abs,
-    "sqrt": lambda x: "sqrt of negative value" if x < 0 else math.sqrt(x),
+    "sqrt": expr_sqrt,
     "exp": math.exp,
     "ln": math.log,
     "sin": math.sin,
@@ -811,14 +967,15 @@ unary_fns: dict[str, UnaryCallable] = {
 }
 
 
+POW10 = tuple(10**i for i in range(64))
+
+
 def binary_e_fn(
     x: Union[int, float], y: Union[int, float]
 ) -> Union[int, float]:
     if isinstance(x, int) and isinstance(y, int):
         if y >= 0:
-            for i in range(y):
-                x = x * 10
-            return x
+            return x * (POW10[y] if y < 64 else 10**y)
         while y < 0:
             if x % 10 == 0:
                 x = x // 10
@@ -829,199 +986,255 @@ def binary_e_fn(
     return x * math.pow(10, y)
 
 
-binary_e_fns: dict[str, BinaryCallable] = {
-    "e": binary_e_fn,
+def divide(x: Union[int, float], y: Union[int, float]) -> float:
+    if y == 0:
+        raise ExprError("Divide by zero")
+    return x / y
+
+
+def modulo(x: Union[int, float], y: Union[int, float]) -> Union[int, float]:
+    if y == 0:
+        raise ExprError("Divide by zero")
+    return x % y
+
+
+# Precedence of the binary "e" operator, which binds tighter than the
+# unary functions and is parsed separately from the other operators
+E_PREC = 8
+
+# Binary operators for #expr as (precedence, function); higher precedence
+# binds tighter.  All of these are left-associative.
+BINARY_OPS: dict[str, tuple[int, BinaryCallable]] = {
+    "or": (1, lambda x, y: 1 if x or y else 0),
+    "and": (2, lambda x, y: 1 if x and y else 0),
+    "=": (3, lambda x, y: int(x == y)),
+    "!=": (3, lambda x, y: int(x != y)),
+    "<>": (3, lambda x, y: int(x != y)),
+    ">": (3, lambda x, y: int(x > y)),
+    "<": (3, lambda x, y: int(x < y)),
+    ">=": (3, lambda x, y: int(x >= y)),
+    "<=": (3, lambda x, y: int(x <= y)),
+    "round": (4, round),  # type:ignore
+    "+": (5, operator.add),
+    "-": (5, operator.sub),
+    "*": (6, operator.mul),
+    "/": (6, divide),
+    "div": (6, divide),
+    "mod": (6, modulo),
+    "^": (7, math.pow),
+    "e": (E_PREC, binary_e_fn),
 }
 
-binary_pow_fns: dict[str, BinaryCallable] = {
-    "^": math.pow,
-}
 
-binary_mul_fns: dict[str, BinaryCallable] = {
-    "*": lambda x, y: x * y,
-    "/": lambda x, y: "Divide by zero" if y == 0 else x / y,
-    "div": lambda x, y: "Divide by zero" if y == 0 else x / y,
-    "mod": lambda x, y: "Divide by zero" if y == 0 else x % y,
-}
+def expr_fn(
+    ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
+) -> str:
+    """Implements the #expr parser function."""
+    full_expr = expander(args[0]).strip().lower() if args else ""
+    # Plain integers are common (e.g., as arguments to templates that
+    # compute something) and need no parsing
+    if full_expr.isdecimal() or (
+        full_expr.startswith("-") and full_expr[1:].isdecimal()
+    ):
+        return str(int(full_expr))
+    return evaluate_expr(full_expr)
 
-binary_add_fns: dict[str, BinaryCallable] = {
-    "+": lambda x, y: x + y,
-    "-": lambda x, y: x - y,
-}
 
-binary_round_fns: dict[str, BinaryCallable] = {
-    "round": round,  # type:ignore
-}
+# Abstract syntax tree node for #expr: ("num", value), ("unary", fn, arg)
+# or ("binary", fn, left, right)
+ExprNode = tuple
 
-binary_cmp_fns: dict[str, BinaryCallable] = {
-    "=": lambda x, y: int(x == y),
-    "!=": lambda x, y: int(x != y),
-    "<>": lambda x, y: int(x != y),
-    ">": lambda x, y: int(x > y),
-    "<": lambda x, y: int(x < y),
-    ">=": lambda x, y: int(x >= y),
-    "<=": lambda x, y: int(x <= y),
-}
 
-binary_and_fns: dict[str, BinaryCallable] = {
-    "and": lambda x, y: 1 if x and y else 0,
+# Named constants (and a lone ".") allowed as #expr atoms
+EXPR_CONSTANTS: dict[str, Union[int, float]] = {
+    "e": math.e,
+    "pi": math.pi,
+    ".": 0,
 }
 
-binary_or_fns: dict[str, BinaryCallable] = {
-    "or": lambda x, y: 1 if x or y else 0,
-}
+EXPR_TOKEN_RE = re.compile(r"\d+(?:\.\d*)?|\.\d+|[a-z]+|!=|<>|>=|<=|[^\s]")
 
 
-def expr_fn(
-    ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
-) -> str:
-    """Implements the #expr parser function."""
-    full_expr = expander(args[0]).strip().lower() if args else ""
-    full_expr = full_expr or ""
-    tokens = list(
-        m.group(0)
-        for m in re.finditer(
-            r"\d+(\.\d*)?|\.\d+|[a-z]+|" r"!=|<>|>=|<=|[^\s]", full_expr
-        )
-    )
-    tokidx = 0
+class ExprParser:
+    """Recursive descent parser for #expr expressions.  The tokens are
+    read from a list by index.  Syntax errors raise ExprError."""
 
-    def expr_error(tok: Optional[str]) -> str:
-        if tok is None:
-            tok = "&lt;end&gt;"
-        # ctx.warning("#expr error near {} in {!r}"
-        #            .format(tok, full_expr),
-        #            sortid="parserfns/781")
-        return '<strong class="error">Expression error near {}</strong>'.format(
-            tok
-        )
+    __slots__ = ("tokens", "i")
 
-    def get_token() -> Optional[str]:
-        nonlocal tokidx
-        if tokidx >= len(tokens):
+    def __init__(self, full_expr: str) -> None:
+        self.tokens: list[str] = EXPR_TOKEN_RE.findall(full_expr)
+        self.i = 0
+
+    def get_token(self) -> Optional[str]:
+        i = self.i
+        if i >= len(self.tokens):
             return None
-        tok = tokens[tokidx]
-        tokidx += 1
-        return tok
+        self.i = i + 1
+        return self.tokens[i]
+
+    def parse(self) -> ExprNode:
+        return self.parse_binary(self.get_token(), 1)
 
-    def unget_token(tok: Optional[str]) -> None:
-        nonlocal tokidx
+    def expr_error(self, tok: Optional[str]) -> ExprError:
         if tok is None:
-            return
-        assert tok == tokens[tokidx - 1]
-        tokidx -= 1
+            tok = "&lt;end&gt;"
+        return ExprError(
+            '<strong class="error">Expression error near {}</strong>'.format(
+                tok
+            )
+        )
 
-    def parse_atom(tok: Optional[str]) -> Union[str, int, float]:
+    def parse_atom(self, tok: Optional[str]) -> ExprNode:
         if tok is None:
-            return expr_error(tok)
+            raise self.expr_error(tok)
         if tok == "(":
-            tok = get_token()
-            ret = parse_expr(tok)
-            tok = get_token()
+            tok = self.get_token()
+            try:
+                ret = self.parse_binary(tok, 1)
+            except ExprError:
+                # a missing closing parenthesis is reported instead
+                tok = self.get_token()
+                if tok != ")":
+                    raise self.expr_error(tok) from None
+                raise
+            tok = self.get_token()
             if tok != ")":
-                return expr_error(tok)
+                raise self.expr_error(tok)
             return ret
+        if tok.isdecimal():
+            return ("num", int(tok))
+        v = EXPR_CONSTANTS.get(tok)
+        if v is not None:
+            return ("num", v)
+        if tok[0].isalpha():
+            # float() would accept "inf" and "nan", which are unknown
+            # words in #expr
+            raise self.expr_error(tok)
         try:
-            ret = int(tok)
-            return ret
-        except ValueError:
-            pass
-        try:
-            ret = float(tok)
-            return ret
+            return ("num", float(tok))
         except ValueError:
-            pass
-        if tok == "e":
-            return math.e
-        if tok == "pi":
-            return math.pi
-        if tok == ".":
-            return 0
-        return expr_error(tok)
-
-    def generic_binary(
-        tok: Optional[str],
-        parser: Callable,
-        fns: dict[str, Callable],
-        assoc="left",
-    ) -> Union[int, float, str]:
-        ret = parser(tok)
-        if isinstance(ret, str):
-            return ret
+            raise self.expr_error(tok) from None
+
+    def parse_unary(self, tok: Optional[str]) -> ExprNode:
+        # Any number of minus signs, optionally followed by one plus sign
+        negate = False
+        while tok == "-":
+            negate = not negate
+            tok = self.get_token()
+        if tok == "+":
+            tok = self.get_token()
+        ret = self.parse_atom(tok)
+        if negate:
+            return ("unary", operator.neg, ret)
+        return ret
+
+    def parse_binary_e(self, tok: Optional[str]) -> ExprNode:
+        # binary "e" operator, binds tighter than the unary functions
+        ret = self.parse_unary(tok)
         while True:
-            tok = get_token()
+            tok = self.get_token()
             if tok is None:
                 return ret
-            fn = fns.get(tok)
-            if fn is None:
+            op = BINARY_OPS.get(tok)
+            if op is None or op[0] != E_PREC:
                 break
-            tok = get_token()
-            ret2 = parser(tok)
-            if isinstance(ret2, str):
-                return ret2
-            ret = fn(ret, ret2)
-        unget_token(tok)
+            ret = ("binary", op[1], ret, self.parse_unary(self.get_token()))
+        self.i -= 1
         return ret
 
-    def parse_unary(tok: Optional[str]) -> Union[str, int, float]:
-        if tok == "-":
-            tok = get_token()
-            ret: Union[str, int, float] = parse_unary(tok)  # type: ignore
-            if isinstance(ret, str):
-                return ret
-            return -ret
-        if tok == "+":
-            tok = get_token()
-            return parse_atom(tok)
-        ret = parse_atom(tok)
+    def parse_unary_fn(self, tok: Optional[str]) -> ExprNode:
+        fns = []
+        while (fn := unary_fns.get(tok)) is not None:  # type: ignore[arg-type]
+            fns.append(fn)
+            tok = self.get_token()
+        ret = self.parse_binary_e(tok)
+        for fn in reversed(fns):
+            ret = ("unary", fn, ret)
         return ret
 
-    def parse_binary_e(tok: Optional[str]) -> Union[str, int, float]:
-        # binary "e" operator
-        return generic_binary(tok, parse_unary, binary_e_fns)
-
-    def parse_unary_fn(tok: Optional[str]) -> Union[str, int, float]:
-        fn = unary_fns.get(tok)  # type: ignore[arg-type]
-        if fn is None:
-            return parse_binary_e(tok)
-        tok = get_token()
-        ret = parse_unary_fn(tok)
-        if isinstance(ret, str):
-            return ret
-        return fn(ret)
-
-    def parse_binary_pow(tok: Optional[str]) -> Union[str, int, float]:
-        return generic_binary(tok, parse_unary_fn, binary_pow_fns)
+    def parse_binary(self, tok: Optional[str], min_prec: int) -> ExprNode:
+        # Precedence climbing: parses operators binding at least as tightly
+        # as min_prec, with the operands of each operator parsed at the
+        # next higher precedence (all operators are left-associative)
+        ret = self.parse_unary_fn(tok)
+        while True:
+            tok = self.get_token()
+            if tok is None:
+                return ret
+            op = BINARY_OPS.get(tok)
+            if op is None or op[0] < min_prec:
+                break
+            prec, fn = op
+            ret2 = self.parse_binary(self.get_token(), prec + 1)
+            ret = ("binary", fn, ret, ret2)
+        # the token read after the end of the expression was not None
+        self.i -= 1
+        return ret
 
-    def parse_binary_mul(tok: Optional[str]) -> Union[str, int, float]:
-        return generic_binary(tok, parse_binary_pow, binary_mul_fns)
 
-    def parse_binary_add(tok: Optional[str]) -> Union[str, int, float]:
-        return generic_binary(tok, parse_binary_mul, binary_add_fns)
+def parse_expr_ast(full_expr: str) -> ExprNode:
+    """Parses a #expr expression into an abstract syntax tree.  Raises
+    ExprError if the expression has a syntax error."""
+    return ExprParser(full_expr).parse()
 
-    def parse_binary_round(tok: Optional[str]) -> Union[str, int, float]:
-        return generic_binary(tok, parse_binary_add, binary_round_fns)
 
-    def parse_binary_cmp(tok: Optional[str]) -> Union[str, int, float]:
-        return generic_binary(tok, parse_binary_round, binary_cmp_fns)
+def eval_expr_ast(node: ExprNode) -> Union[int, float]:
+    """Evaluates an abstract syntax tree returned by parse_expr_ast().
+    Raises ExprError if an operation fails (e.g., division by zero)."""
+    kind = node[0]
+    if kind == "num":
+        return node[1]
+    if kind == "unary":
+        return node[1](eval_expr_ast(node[2]))
+    return node[1](eval_expr_ast(node[2]), eval_expr_ast(node[3]))
 
-    def parse_binary_and(tok: Optional[str]) -> Union[str, int, float]:
-        return generic_binary(tok, parse_binary_cmp, binary_and_fns)
 
-    def parse_binary_or(tok: Optional[str]) -> Union[str, int, float]:
-        return generic_binary(tok, parse_binary_and, binary_or_fns)
+@lru_cache(maxsize=8192)
+def evaluate_expr(full_expr: str) -> str:
+    """Evaluates an (already expanded and lowercased) #expr expression and
+    returns the result or an error message as a string.  #expr has no
+    variables, so the result only depends on the expression and is cached
+    (which also covers the parsing); templates evaluate the same
+    expressions over and over again."""
+    try:
+        ret = eval_expr_ast(parse_expr_ast(full_expr))
+    except ExprError as e:
+        return str(e)
+    if isinstance(ret, float) and ret.is_integer():
+        return str(int(ret))
+    return str(ret)
 
-    def parse_expr(tok: Optional[str]) -> Union[str, int, float]:
-        return parse_binary_or(tok)
 
-    tok = get_token()
-    ret = parse_expr(tok)
-    if isinstance(ret, str):
-        return ret
-    if isinstance(ret, float):
-        if ret == math.floor(ret):
-            return str(int(ret))
-    return str(ret)
+def pad_string(v: str, cnt: int, pad: str, direction: str) -> str:
+    """Pads ``v`` to ``cnt`` characters by repeating ``pad`` on the left,
+    on the right or on both sides ("center"), as in padleft, padright
+    and #pad."""
+    padlen = cnt - len(v)
+    if padlen <= 0 or not pad:
+        return v
+    if len(pad) == 1:
+        if direction == "right":
+            return v.ljust(cnt, pad)
+        if direction == "center":
+            # not str.center(), which puts an odd extra character on the left
+            left = padlen // 2
+            return pad * left + v + pad * (padlen - left)
+        return v.rjust(cnt, pad)
+    pad = pad * (padlen // len(pad) + 1)
+    if direction == "right":
+        return v + pad[:padlen]
+    if direction == "center":
+        return pad[: padlen // 2] + v + pad[: padlen - padlen // 2]
+    return pad[:padlen] + v
+
+
+def int_arg(s: str, default: int = 0) -> int:
+    """Converts a (stripped) numeric parser function argument to an
+    integer, returning the default if it is not an integer."""
+    try:
+        return int(s)
+    except ValueError:
+        return default
 
 
 def padleft_fn(
@@ -1030,9 +1243,8 @@ def padleft_fn(
     """Implements the padleft parser function."""
     v = expander(args[0]) if args else ""
     cntstr = expander(args[1]).strip() if len(args) >= 2 else "0"
-    pad = expander(args[2]) if len(args) >= 3 and args[2] else "0"
-    if not cntstr.isdigit():
-        if cntstr.startswith("-") and cntstr[1:].isdigit():
+    if not cntstr.isdecimal():
+        if cntstr.startswith("-") and cntstr[1:].isdecimal():
             pass
         else:
             ctx.warning(
@@ -1042,11 +1254,11 @@ def padleft_fn(
         cnt = 0
     else:
         cnt = int(cntstr)
-    if cnt - len(v) > len(pad):
-        pad = pad * ((cnt - len(v)) // len(pad))
-    if len(v) < cnt:
-        v = pad[: cnt - len(v)] + v
-    return v
+    if len(v) >= cnt:
+        return v
+    # the pad string is only expanded when it is needed
+    pad = expander(args[2]) if len(args) >= 3 and args[2] else "0"
+    return pad_string(v, cnt, pad, "left")
 
 
 def padright_fn(
@@ -1055,46 +1267,52 @@ def padright_fn(
     """Implements the padright parser function."""
     v = expander(args[0]) if args else ""
     cntstr = expander(args[1]).strip() if len(args) >= 2 else "0"
-    arg2 = expander(args[2]) if len(args) >= 3 and args[2] else "0"
-    pad = arg2 if len(args) >= 3 and arg2 else "0"
-    if not cntstr.isdigit():
+    if not cntstr.isdecimal():
         cnt = 0
-        if cntstr.startswith("-") and cntstr[1:].isdigit():
+        if cntstr.startswith("-") and cntstr[1:].isdecimal():
             pass
         else:
             ctx.warning(
-                "pad length is not integer: {!r}".format(cnt),
+                "pad length is not integer: {!r}".format(cntstr),
                 sortid="parserfns/940",
             )
     else:
         cnt = int(cntstr)
-    if cnt - len(v) > len(pad):
-        pad = pad * ((cnt - len(v)) // len(pad))
-    if len(v) < cnt:
-        v = v + pad[: cnt - len(v)]
-    return v
+    if len(v) >= cnt:
+        return v
+    pad = expander(args[2]) if len(args) >= 3 and args[2] else "0"
+    return pad_string(v, cnt, pad, "right")
 
 
 def plural_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the #plural parser function."""
-    expr = expander(args[0]).strip() if args else "0"
-    v = expr_fn(ctx, fn_name, [expr], lambda x: x)
+    expr = expander(args[0]).strip().lower() if args else "0"
+    v = evaluate_expr(expr)
     # XXX for some language codes, this is more complex.  See {{plural:...}} in
     # https://www.mediawiki.org/wiki/Help:Magic_words
-    if v == 1:
+    if v == "1":
         return expander(args[1]).strip() if len(args) >= 2 else ""
     return expander(args[2]).strip() if len(args) >= 3 else ""
 
 
+MONTH_DAYS = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
 def month_num_days(ctx: "Wtp", t: datetime) -> int:
-    mdays = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
-    v = mdays[t.month - 1]
-    if t.month == 2:
-        if t.year % 4 == 0 and (t.year % 100 != 0 or t.year % 400 == 0):
-            v = 29
-    return v
+    if t.month == 2 and calendar.isleap(t.year):
+        return 29
+    return MONTH_DAYS[t.month - 1]
+
+
+def utc_offset(ctx: "Wtp", t: datetime) -> str:
+    return t.strftime("%z")[:5]
+
+
+def utc_offset_colon(ctx: "Wtp", t: datetime) -> str:
+    z = t.strftime("%z")
+    return z[:3] + ":" + z[3:5]
 
 
 time_fmt_map: dict[
@@ -1103,9 +1321,7 @@ time_fmt_map: dict[
 ] = {
     "Y": "%Y",
     "y": "%y",
-    "L": lambda ctx, t: 1
-    if (t.year % 4 == 0 and (t.year % 100 != 0 or t.year % 400 == 0))
-    else 0,
+    "L": lambda ctx, t: 1 if calendar.isleap(t.year) else 0,
     "o": "%G",
     "n": lambda ctx, t: t.month,
     "m": "%m",
@@ -1114,9 +1330,7 @@ time_fmt_map: dict[
     "xg": "%B",  # Should be in genitive
     "j": lambda ctx, t: t.day,
     "d": "%d",
-    "z": lambda ctx, t: (
-        t - datetime(year=t.year, month=1, day=1, tzinfo=t.tzinfo)
-    ).days,
+    "z": lambda ctx, t: t.timetuple().tm_yday - 1,
     "W": "%V",
     "N": "%u",
     "w": "%w",
@@ -1133,14 +1347,14 @@ time_fmt_map: dict[
     "U": lambda ctx, t: int(t.timestamp()),
     "e": "%Z",
     "I": lambda ctx, t: "1" if t.dst() and t.dst().seconds != 0 else "0",  # type: ignore[union-attr]
-    "0": lambda ctx, t: t.strftime("%z")[:5],
-    "P": lambda ctx, t: t.strftime("%z")[:3] + ":" + t.strftime("%z")[3:5],
+    "0": utc_offset,
+    "P": utc_offset_colon,
     "T": "%Z",
     "Z": lambda ctx, t: 0 if t.utcoffset() is None else t.utcoffset().seconds,  # type: ignore[union-attr]
     "t": month_num_days,
     "c": lambda ctx, t: t.isoformat(),
-    "r": lambda ctx, t: t.strftime("%a, %d %b %Y %H:%M:%S {}").format(
-        t.strftime("%z")[:5]
+    "r": lambda ctx, t: (
+        t.strftime("%a, %d %b %Y %H:%M:%S ") + utc_offset(ctx, t)
     ),
     "%": "%%",  # in case there's a stray % in the original Wiki-side format
     # XXX non-gregorian calendar values
@@ -1151,36 +1365,84 @@ time_fmt_map: dict[
 MEDIAWIKI_TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
 
 
-def format_with_wiki_timeformat(ctx: "Wtp", t: datetime, fmt: str) -> str:
-    def fmt_repl(m: re.Match) -> str:
+TIME_FMT_RE = re.compile(r'(x[mijkot]?)?[^"]|"[^"]*"')
+
+TimeFmtPart = Union[str, Callable[["Wtp", datetime], Union[int, float, str]]]
+
+
+@lru_cache(maxsize=512)
+def compile_wiki_timeformat(fmt: str) -> tuple[TimeFmtPart, ...]:
+    """Converts a #time format string into a tuple of strftime format
+    strings (with adjacent pieces merged) and callables that compute the
+    directives strftime does not support.  The same few formats are used
+    over and over again, so the result is cached."""
+    parts: list[TimeFmtPart] = []
+
+    def add(v: TimeFmtPart) -> None:
+        if isinstance(v, str) and parts and isinstance(parts[-1], str):
+            parts[-1] += v
+        elif v != "":
+            parts.append(v)
+
+    if '"' not in fmt and "x" not in fmt:
+        # Most formats have no quoted text or two-letter directives; each
+        # character is then a directive or a literal character by itself
+        for c in fmt:
+            add(time_fmt_map.get(c, c))
+        return tuple(parts)
+
+    pos = 0
+    for m in TIME_FMT_RE.finditer(fmt):
+        # characters the regexp does not match (unclosed quotes) are kept
+        add(fmt[pos : m.start()])
+        pos = m.end()
         f = m.group(0)
         if len(f) > 1 and f.startswith('"') and f.endswith('"'):
-            return f[1:-1]
-        if f in time_fmt_map:
-            v = time_fmt_map[f]
-            if isinstance(v, str):
-                return v
-            assert callable(v)
-            v2 = v(ctx, t)
-            if not isinstance(v2, str):
-                v2 = str(v2)
-            return v2
-        return f
+            add(f[1:-1])
+        else:
+            add(time_fmt_map.get(f, f))
+    add(fmt[pos:])
+    return tuple(parts)
+
+
+def format_with_wiki_timeformat(ctx: "Wtp", t: datetime, fmt: str) -> str:
+    parts = compile_wiki_timeformat(fmt)
+    if len(parts) == 1 and isinstance(parts[0], str):
+        return t.strftime(parts[0])
+    return t.strftime(
+        "".join(v if isinstance(v, str) else str(v(ctx, t)) for v in parts)
+    )
+
 
-    fmt = re.sub(r'(x[mijkot]?)?[^"]|"[^"]*"', fmt_repl, fmt)
+TIME_ADD_RE = re.compile(r"([^+]*)\s*(\+\s*\d+\s*(day|year|month)s?)\s*$")
 
-    return t.strftime(fmt)
+# Timestamps with a full ISO date and none of these words mean the same
+# time whenever they are parsed (dateparser fills in missing fields, such as
+# the day in "April 2007", from the current date)
+RELATIVE_TIME_RE = re.compile(
+    r"(?i)\b(?:now|today|tomorrow|yesterday|ago|in|next|last|this)\b"
+)
+
+TIMESTAMP_SETTINGS: "dateparser._Settings" = {"RETURN_AS_TIMEZONE_AWARE": True}
+
+
+@lru_cache(maxsize=1024)
+def parse_absolute_time(dt: str) -> Optional[datetime]:
+    """Parses a timestamp that does not depend on the current time with
+    dateparser, which is slow.  The same dates are given to #time on many
+    pages, so the results are cached."""
+    return dateparser.parse(dt, settings=TIMESTAMP_SETTINGS)
 
 
 def parse_timestamp(
     ctx: "Wtp", fn_name: str, loc: str, dt: str
 ) -> Union[datetime, str]:
     orig_dt = dt
-    dt = re.sub(r"\+", " in ", dt)
+    dt = dt.replace("+", " in ")
     if not dt:
         dt = "now"
 
-    settings: dateparser._Settings = {"RETURN_AS_TIMEZONE_AWARE": True}
+    settings = TIMESTAMP_SETTINGS
     if loc in ("", "0"):
         dt += " UTC"
 
@@ -1201,16 +1463,17 @@ def parse_timestamp(
         # php's strtotime() (which is the original function used)
         # but we can handle special cases here and hope
         # people on wiktionary don't go crazy with weird formatting
-        t = dateparser.parse(dt, settings=settings)
+        if ISO_DATE_RE.match(dt) and not RELATIVE_TIME_RE.search(dt):
+            t = parse_absolute_time(dt)
+        else:
+            t = dateparser.parse(dt, settings=settings)
         if t is None:
-            m = re.match(
-                r"([^+]*)\s*(\+\s*\d+\s*(day|year|month)s?)\s*$", orig_dt
-            )
+            m = TIME_ADD_RE.match(orig_dt)
             if m:
                 main_date = dateparser.parse(m.group(1), settings=settings)
                 add_time = dateparser.parse(m.group(2), settings=settings)
-                now = dateparser.parse("now", settings=settings)
-                if main_date and add_time is not None and now is not None:
+                now = datetime.now(timezone.utc)
+                if main_date and add_time is not None:
                     # this is just a kludge: dateparser parses "+2 days" as
                     # "2 days AGO". The now-datetime object is used to check
                     # just in case which way the parsing goes (we're relying
@@ -1286,17 +1549,25 @@ def len_fn(
     return str(len(v))
 
 
+def expand_arg_or_default(
+    args: list[str], i: int, expander: Callable[[str], str], default: str
+) -> str:
+    """Expands the argument at index ``i``, returning the default if the
+    argument is missing or expands to an empty string (e.g., the search
+    string of #pos, #rpos, #replace and #explode is a space by default)."""
+    if len(args) > i:
+        return expander(args[i]) or default
+    return default
+
+
 def pos_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the #pos parser function."""
     arg0 = expander(args[0]).strip() if args else ""
-    arg1 = expander(args[1]) or " " if len(args) >= 2 else " "
+    arg1 = expand_arg_or_default(args, 1, expander, " ")
     offsetstr = expander(args[2]).strip() if len(args) >= 3 else ""
-    if not offsetstr or not offsetstr.isdigit():
-        offset = 0
-    else:
-        offset = int(offsetstr)
+    offset = int(offsetstr) if offsetstr.isdecimal() else 0
     idx = arg0.find(arg1, offset)
     if idx >= 0:
         return str(idx)
@@ -1308,12 +1579,9 @@ def rpos_fn(
 ) -> str:
     """Implements the #rpos parser function."""
     arg0 = expander(args[0]).strip() if args else ""
-    arg1 = expander(args[1]) or " " if len(args) >= 2 else " "
+    arg1 = expand_arg_or_default(args, 1, expander, " ")
     offsetstr = expander(args[2]).strip() if len(args) >= 3 else ""
-    if not offsetstr or not offsetstr.isdigit():
-        offset = 0
-    else:
-        offset = int(offsetstr)
+    offset = int(offsetstr) if offsetstr.isdecimal() else 0
     idx = arg0.rfind(arg1, offset)
     if idx >= 0:
         return str(idx)
@@ -1327,21 +1595,18 @@ def sub_fn(
     arg0 = expander(args[0]).strip() if args else ""
     startstr = expander(args[1]).strip() if len(args) >= 2 else ""
     lengthstr = expander(args[2]).strip() if len(args) >= 3 else ""
-    try:
-        start = int(startstr)
-    except ValueError:
-        start = 0
+    n = len(arg0)
+    start = int_arg(startstr)
     if start < 0:
-        start = max(0, len(arg0) + start)
-    start = min(start, len(arg0))
-    try:
-        length = int(lengthstr)
-    except ValueError:
-        length = 0
+        start = max(0, n + start)
+    elif start > n:
+        start = n
+    length = int_arg(lengthstr)
     if length == 0:
-        length = max(0, len(arg0) - start)
-    elif length < 0:
-        length = max(0, len(arg0) - start + length)
+        return arg0[start:]
+    if length < 0:
+        # a negative length leaves out characters from the end
+        return arg0[start : max(start, n + length)]
     return arg0[start : start + length]
 
 
@@ -1351,9 +1616,7 @@ def pad_fn(
     """Implements the pad parser function."""
     v = expander(args[0]).strip() if args else ""
     cntstr = expander(args[1]).strip() if len(args) >= 2 else ""
-    pad = expander(args[2]) if len(args) >= 3 and args[2] else "0"
-    direction = expander(args[3]) if len(args) >= 4 else ""
-    if not cntstr.isdigit():
+    if not cntstr.isdecimal():
         ctx.warning(
             "pad length is not integer: {!r}".format(cntstr),
             sortid="parserfns/1133",
@@ -1361,17 +1624,11 @@ def pad_fn(
         cnt = 0
     else:
         cnt = int(cntstr)
-    if cnt - len(v) > len(pad):
-        pad = pad * ((cnt - len(v)) // len(pad) + 1)
-    if len(v) < cnt:
-        padlen = cnt - len(v)
-        if direction == "right":
-            v = v + pad[:padlen]
-        elif direction == "center":
-            v = pad[: padlen // 2] + v + pad[: padlen - padlen // 2]
-        else:  # left
-            v = pad[:padlen] + v
-    return v
+    if len(v) >= cnt:
+        return v
+    pad = expander(args[2]) if len(args) >= 3 and args[2] else "0"
+    direction = expander(args[3]) if len(args) >= 4 else ""
+    return pad_string(v, cnt, pad, direction)
 
 
 def replace_fn(
@@ -1379,7 +1636,9 @@ def replace_fn(
 ) -> str:
     """Implements the #replace parser function."""
     arg0 = expander(args[0]).strip() if args else ""
-    arg1 = expander(args[1]) or " " if len(args) >= 2 else " "
+    arg1 = expand_arg_or_default(args, 1, expander, " ")
+    if arg1 not in arg0:
+        return arg0
     arg2 = expander(args[2]) if len(args) >= 3 else ""
     return arg0.replace(arg1, arg2)
 
@@ -1389,20 +1648,17 @@ def explode_fn(
 ) -> str:
     """Implements the #explode parser function."""
     arg0 = expander(args[0]).strip() if args else ""
-    delim = expander(args[1]) or " " if len(args) >= 2 else " "
+    delim = expand_arg_or_default(args, 1, expander, " ")
     posstr = expander(args[2]).strip() if len(args) >= 3 else ""
     limitstr = expander(args[3]).strip() if len(args) >= 4 else ""
-    try:
-        position = int(posstr)
-    except ValueError:
-        position = 0
-    try:
-        limit = int(limitstr)
-    except ValueError:
-        limit = 0
-    parts = arg0.split(delim)
-    if limit > 0 and len(parts) > limit:
-        parts = parts[: limit - 1] + [delim.join(parts[limit - 1 :])]
+    position = int_arg(posstr)
+    limit = int_arg(limitstr)
+    # with a limit, the last part holds the rest of the string
+    maxsplit = limit - 1 if limit > 0 else -1
+    if position >= 0 and (maxsplit < 0 or maxsplit > position + 1):
+        # the parts after the requested one need not be split
+        maxsplit = position + 1
+    parts = arg0.split(delim, maxsplit)
     if position < 0:
         position = len(parts) + position
     if position < 0 or position >= len(parts):
@@ -1410,13 +1666,22 @@ def explode_fn(
     return parts[position]
 
 
+@lru_cache(maxsize=4096)
+def urldecode(text: str) -> str:
+    """Decodes a URL-encoded string for #urldecode.  Templates decode the
+    same section and page names over and over again, so the results are
+    cached."""
+    return urllib.parse.unquote_plus(text)
+
+
 def urldecode_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the #urldecode parser function."""
     arg0 = expander(args[0]).strip() if args else ""
-    ret = urllib.parse.unquote_plus(arg0)
-    return ret
+    if "%" not in arg0 and "+" not in arg0:
+        return arg0
+    return urldecode(arg0)
 
 
 def shortdesc_fn(
@@ -1545,7 +1810,7 @@ def localyear_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the LOCALYEAR magic word."""
-    utc_dt = datetime.now(timezone.utc)
+    utc_dt = page_time(ctx)
     return str(utc_dt.astimezone().year)
 
 
@@ -1553,27 +1818,27 @@ def localmonth_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the LOCALMONTH magic word."""
-    utc_dt = datetime.now(timezone.utc)
+    utc_dt = page_time(ctx)
     return utc_dt.astimezone().strftime("%m")
 
 
 def localmonthname_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
-    return datetime.now(timezone.utc).astimezone().strftime("%B")
+    return MONTH_NAMES[page_time(ctx).astimezone().month]
 
 
 def localmonthabbrev_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
-    return datetime.now(timezone.utc).astimezone().strftime("%b")
+    return MONTH_ABBREVS[page_time(ctx).astimezone().month]
 
 
 def localday_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the LOCALDAY magic word."""
-    utc_dt = datetime.now(timezone.utc)
+    utc_dt = page_time(ctx)
     return utc_dt.astimezone().strftime("%-d")
 
 
@@ -1581,7 +1846,7 @@ def localday2_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the LOCALDAY2 magic word, with a possible leading zero."""
-    utc_dt = datetime.now(timezone.utc)
+    utc_dt = page_time(ctx)
     return utc_dt.astimezone().strftime("%d")
 
 
@@ -1589,27 +1854,27 @@ def localdow_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     # Day of the week (unpadded number), 0 (for Sunday) through 6 (for Saturday)
-    return str(datetime.now(timezone.utc).astimezone().isoweekday() % 7)
+    return str(page_time(ctx).astimezone().isoweekday() % 7)
 
 
 def localdayname_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
-    return datetime.now(timezone.utc).astimezone().strftime("%A")
+    return page_time(ctx).astimezone().strftime("%A")
 
 
 def localtime_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the LOCALTIME magic word."""
-    return datetime.now(timezone.utc).astimezone().strftime("%H:%M")
+    return page_time(ctx).astimezone().strftime("%H:%M")
 
 
 def localhour_fn(
     ctx: "Wtp", fn_name: str, args: list[str], expander: Callable[[str], str]
 ) -> str:
     """Implements the LOCALHOUR magic word."""
-    return datetime.now(timezone.utc).astimezone().strftime("%H")
+    return page_time(ctx).astimezone().strftime("%H")
 
 
 def number_of_pages_fn(
@@ -1699,7 +1964,7 @@ PARSER_FUNCTIONS = {
     "CURRENTMONTHABBREV": currentmonthabbrev_fn,
     "CURRENTDAY": currentday_fn,
     "CURRENTDAY2": currentday2_fn,
-    "CUEEWNTDOW": currentdow_fn,
+    "CURRENTDOW": currentdow_fn,
     "CURRENTDAYNAME": currentdayname_fn,
     "CURRENTTIME": currenttime_fn,
     "CURRENTHOUR": currenthour_fn,
@@ -1810,6 +2075,17 @@ PARSER_FUNCTIONS = {
 }
 
 
+# PARSER_FUNCTIONS normalized to (function, accepts_keyed_args) pairs so
+# that dispatching takes a single lookup.  The keys are interned like the
+# names from Wtp._canonicalize_parserfn_name().  PARSER_FUNCTIONS is treated
+# as static: it must not be changed after this module has been imported
+# (Wtp._canonicalize_parserfn_name() also caches lookups in it).
+PARSER_FUNCTION_TABLE: dict[str, tuple[Callable[..., str], bool]] = {
+    sys.intern(k): v if isinstance(v, tuple) else (v, False)
+    for k, v in PARSER_FUNCTIONS.items()
+}
+
+
 def call_parser_function(
     ctx: "Wtp",
     fn_name: str,
@@ -1820,29 +2096,22 @@ def call_parser_function(
     assert isinstance(fn_name, str)
     assert isinstance(args, (list, tuple, dict))
     assert callable(expander)
-    if fn_name not in PARSER_FUNCTIONS:
+    entry = PARSER_FUNCTION_TABLE.get(fn_name)
+    if entry is None:
         ctx.error(
             "unrecognized parser function {!r}".format(fn_name),
             sortid="parserfns/1354",
         )
         return ""
-    fn = PARSER_FUNCTIONS[fn_name]
-    accept_keyed_args = False
-    if isinstance(fn, tuple):
-        accept_keyed_args = fn[1]
-        fn = fn[0]
-    assert callable(fn)
+    fn, accept_keyed_args = entry
     have_keyed_args = False
     if isinstance(args, dict) and not accept_keyed_args:
         # Convert from dict to vector, no keyed args allowed
         new_args = []
-        for i in range(1, 1000):
-            v = args.get(i, None)
-            if v is None:
-                break
-            new_args.append(v)
-        for i in range(1, len(new_args) + 1):
-            del args[i]
+        i = 1
+        while i in args:
+            new_args.append(args.pop(i))
+            i += 1
         have_keyed_args = len(args) > 0
         args = new_args
     elif accept_keyed_args:
@@ -1855,7 +2124,7 @@ def call_parser_function(
             ofs = arg.find("=")
             if ofs >= 0:
                 k = arg[:ofs]
-                if k.isdigit():
+                if k.isdecimal():
                     k = int(k)
                 arg = arg[ofs + 1 :]
             else:
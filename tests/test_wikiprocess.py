@@ -5,6 +5,7 @@
 import math
 import time
 import unittest
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from unittest.mock import patch
 
@@ -316,6 +317,14 @@ return export
         ret = self.ctx.expand("{{#ifexist:Test title|T|F}}")
         self.assertEqual(ret, "T")
 
+    def test_ifexist4(self):
+        self.ctx.start_page("Tt")
+        ret = self.ctx.expand("{{#ifexist:New page|T|F}}")
+        self.assertEqual(ret, "F")
+        self.ctx.add_page("New page", 0, "body")
+        ret = self.ctx.expand("{{#ifexist:New page|T|F}}")
+        self.assertEqual(ret, "T")
+
     def test_switch1(self):
         self.parserfn("{{#switch:a|a=one|b=two|three}}", "one")
 
@@ -355,6 +364,19 @@ return export
     def test_switch12(self):
         self.parserfn("{{#switch:|a=one|=empty|three}}", "empty")
 
+    def test_switch13(self):
+        self.parserfn("{{#switch:c|a|b|c|d=four|c=five}}", "four")
+
+    def test_switch14(self):
+        self.parserfn("{{#switch:a|a=one|a=two|#default=x|#default=y}}", "one")
+
+    def test_switch15(self):
+        self.parserfn("{{#switch:e|a=one|#default=x|#default=y}}", "y")
+
+    def test_switch16(self):
+        self.ctx.add_page("Template:swkey", 10, "b")
+        self.parserfn("{{#switch:b|a=one|{{swkey}}=two|three}}", "two")
+
     # XXX test that both sides of switch are evaluated
 
     def test_categorytree1(self):
@@ -611,6 +633,12 @@ MORE
     def test_formatnum10(self):
         self.parserfn("{{formatnum:12345}}", "12,345")
 
+    def test_formatnum11(self):
+        self.parserfn("{{formatnum:-123}}", "-123")
+
+    def test_formatnum12(self):
+        self.parserfn("{{formatnum:-1234567.5}}", "-1,234,567.5")
+
     def test_dateformat1(self):
         self.parserfn("{{#dateformat:25 dec 2009|ymd}}", "2009 Dec 25")
 
@@ -641,6 +669,14 @@ MORE
     def test_dateformat10(self):
         self.parserfn("{{#dateformat:25 December|dmy}}", "25 Dec")
 
+    def test_dateformat11(self):
+        self.parserfn(
+            "{{#dateformat:2011-11-09T10:11:12|ymd}}", "2011 Nov 09 10:11:12"
+        )
+
+    def test_dateformat12(self):
+        self.parserfn("{{#dateformat:2011-02-30|dmy}}", "2011-02-30")
+
     def test_formatdate1(self):
         self.parserfn("{{#formatdate:25 December|dmy}}", "25 Dec")
 
@@ -675,6 +711,11 @@ MORE
     def test_achorencode1(self):
         self.parserfn("{{anchorencode:x:y/z kä}}", "x:y/z_kä")
 
+    def test_achorencode2(self):
+        self.parserfn(
+            """{{anchorencode:a "b" <c>'d'}}""", "a_.22b.22_.3Cc.3E.27d.27"
+        )
+
     def test_ns1(self):
         self.parserfn("{{ns:6}}", "File")
 
@@ -687,6 +728,9 @@ MORE
     def test_ns4(self):
         self.parserfn("{{ns:Nonexistentns}}", "[[:Template:ns:Nonexistentns]]")
 
+    def test_ns5(self):
+        self.parserfn("{{ns:image}}", "File")
+
     def test_titleparts1(self):
         self.parserfn("{{#titleparts:foo}}", "foo")
 
@@ -909,6 +953,18 @@ MORE
     def test_expr65(self):
         self.parserfn("{{#expr|.}}", "0")
 
+    def test_expr66(self):
+        self.parserfn(
+            "{{#expr:inf}}",
+            '<strong class="error">Expression error near inf</strong>',
+        )
+
+    def test_expr67(self):
+        self.parserfn(
+            "{{#expr:1+nan}}",
+            '<strong class="error">Expression error near nan</strong>',
+        )
+
     def test_padleft1(self):
         self.parserfn("{{padleft:xyz|5}}", "00xyz")
 
@@ -924,6 +980,9 @@ MORE
     def test_padleft5(self):
         self.parserfn("{{padleft:|1|xyz}}", "x")
 
+    def test_padleft6(self):
+        self.parserfn("{{padleft:x|6|ab}}", "ababax")
+
     def test_padright1(self):
         self.parserfn("{{padright:xyz|5}}", "xyz00")
 
@@ -939,6 +998,13 @@ MORE
     def test_padright5(self):
         self.parserfn("{{padright:|1|xyz}}", "x")
 
+    def test_padright6(self):
+        self.parserfn("{{padright:x|6|ab}}", "xababa")
+
+    def test_padright7(self):
+        # a pad string that expands to nothing leaves the value unpadded
+        self.parserfn("{{padright:xyz|5|{{{1|}}}}}", "xyz")
+
     def test_time1(self):
         self.ctx.start_page("Tt")
         t1 = time.time()
@@ -1105,6 +1171,23 @@ MORE
     def test_time45(self):
         self.parserfn("{{#time:z|February 2, 2007}}", "32")
 
+    def test_time46(self):
+        self.parserfn(
+            '{{#time:j "of" F Y, G:i|July 4, 2004 10:11:22}}',
+            "4 of July 2004, 10:11",
+        )
+
+    def test_time47(self):
+        # full dates give the same time whenever they are parsed, while
+        # partial and relative dates depend on the current date
+        today = datetime.now(timezone.utc)
+        tomorrow = today + timedelta(days=1)
+        self.parserfn("{{#time:Y-m-d|2007-04-01}}", "2007-04-01")
+        self.parserfn("{{#time:Y-m|April 2007}}", "2007-04")
+        self.parserfn("{{#time:Y-m-d|now}}", today.strftime("%Y-%m-%d"))
+        self.parserfn("{{#time:Y-m-d|+1 day}}", tomorrow.strftime("%Y-%m-%d"))
+        self.parserfn("{{#time:Y-m-d|2007-04-01}}", "2007-04-01")
+
     def test_len1(self):
         self.parserfn("{{#len: xyz }}", "3")
 
@@ -1120,6 +1203,9 @@ MORE
     def test_pos3(self):
         self.parserfn("{{#pos: xyz ayz }}", "3")
 
+    def test_pos4(self):
+        self.parserfn("{{#pos: xyzayz |yz|²}}", "1")
+
     def test_rpos1(self):
         self.parserfn("{{#rpos: xyzayz |yz}}", "4")
 
@@ -1171,6 +1257,12 @@ MORE
     def test_pad5(self):
         self.parserfn("{{#pad:Ice|5|x}}", "xxIce")
 
+    def test_plural1(self):
+        self.parserfn("{{plural:1|is|are}}", "is")
+
+    def test_plural2(self):
+        self.parserfn("{{plural:3-1|is|are}}", "are")
+
     def test_replace1(self):
         self.parserfn("{{#replace:Icecream|e|E}}", "IcEcrEam")
 
@@ -1291,6 +1383,11 @@ MORE
             ],
         )
 
+    def test_currentdow1(self):
+        self.ctx.start_page("test page")
+        ret = self.ctx.expand("{{CURRENTDOW}}")
+        self.assertIn(ret, ["0", "1", "2", "3", "4", "5", "6"])
+
     @patch(
         "wikitextprocessor.core.Wtp.get_page",
         return_value=Page(